@@ -7,47 +7,50 @@ import sys
 import os
 import json
 import traceback
-import importlib.util
+import importlib
+
+# orjson is optional: faster parsing/serialization, stdlib json otherwise
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+
+def _dumps(obj) -> bytes:
+    """Serialize obj to JSON bytes."""
+    return orjson.dumps(obj) if orjson else json.dumps(obj).encode()
+
+
+_loads = orjson.loads if orjson else json.loads
 
 # Initialize app to None - will be set below
 app = None
 
-# Create minimal ASGI app function - defined early to avoid dependency issues
+class MinimalASGIApp:
+    """Bare ASGI app answering 503, used when the real app cannot be built."""
+
+    title = "Spectra API"
+    version = "0.2.0"
+    _body = _dumps({"error": "Service unavailable", "message": "Initialization failed"})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            await send({"type": "http.response.start", "status": 503, "headers": [[b"content-type", b"application/json"]]})
+            await send({"type": "http.response.body", "body": self._body})
+
+
 def _create_minimal_asgi_app():
     """Create minimal ASGI app that always works."""
-    class MinimalASGIApp:
-        def __init__(self):
-            self.title = "Spectra API"
-            self.version = "0.2.0"
-        async def __call__(self, scope, receive, send):
-            if scope["type"] == "http":
-                body = json.dumps({"error": "Service unavailable", "message": "Initialization failed"}).encode()
-                await send({"type": "http.response.start", "status": 503, "headers": [[b"content-type", b"application/json"]]})
-                await send({"type": "http.response.body", "body": body})
     return MinimalASGIApp()
 
-# Safe import function that catches ALL errors
+
 def _safe_import(module_name):
-    """Safely import a module, returning None if import fails."""
+    """Safely import a module, returning None if import fails.
+
+    The api directory is put on sys.path once, before any of these imports run.
+    """
     try:
-        try:
-            api_dir = os.path.dirname(os.path.abspath(__file__))
-            if api_dir and api_dir not in sys.path:
-                sys.path.insert(0, api_dir)
-        except Exception:
-            pass
-        try:
-            return __import__(module_name, fromlist=[''])
-        except Exception:
-            try:
-                spec = importlib.util.find_spec(module_name)
-                if spec and spec.loader:
-                    module = importlib.util.module_from_spec(spec)
-                    spec.loader.exec_module(module)
-                    return module
-            except Exception:
-                pass
-        return None
+        return importlib.import_module(module_name)
     except BaseException:
         return None
 
@@ -55,8 +58,13 @@ def _safe_import(module_name):
 try:
     import logging
     import asyncio
+    import concurrent.futures
+    import functools
+    import hashlib
+    import re
+    import time
     import uuid
-    from typing import Optional, Dict, Any
+    from typing import Optional, Dict, Any, List
 
     # Initialize logger with fallback
     logger = None
@@ -72,6 +80,215 @@ try:
             def setLevel(self, level): pass
         logger = SimpleLogger()
 
+    # uvloop for loops created after import (the Mangum handler() path). uvicorn picks it
+    # up on its own when installed with uvicorn[standard]; stdlib asyncio otherwise.
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
+    # Gemini model and prompts. SYSTEM_PROMPT is identical for every request, so it is
+    # uploaded once as explicit cached content; only build_user_prompt() varies per call.
+    GEMINI_MODEL = "gemini-1.5-flash"
+    GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta/"
+    GEMINI_CACHE_TTL_SECONDS = 3600
+    GEMINI_CACHE_REFRESH_MARGIN = 300  # re-create the cache this many seconds before expiry
+    # The shared client has no read timeout, and the cache is created under a lock every
+    # request waits on, so creating it gets its own deadline
+    GEMINI_CACHE_CREATE_TIMEOUT = 30.0
+    # Set SPECTRA_CONTEXT_CACHE=0 to always send the system prompt inline
+    GEMINI_CONTEXT_CACHE = os.getenv("SPECTRA_CONTEXT_CACHE", "1") == "1"
+    # Explicit caching rejects content under the model's minimum size (32,768 tokens for gemini-1.5-flash)
+    GEMINI_CACHE_MIN_TOKENS = 32768
+    # Rate limiting and transient server errors are retried with backoff (0.5s, 1s)
+    GEMINI_MAX_ATTEMPTS = 3
+    GEMINI_RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+    # Gemini's own retry hint (Retry-After, or RetryInfo in a 429 body) is honored up to this
+    GEMINI_RETRY_DELAY_MAX = 60.0
+    # Structured output: Gemini's decoding is constrained to this shape, so every reply
+    # parses and has all three keys, in the order the streaming endpoint emits them
+    DEVOPS_FILES_SCHEMA = {
+        "type": "OBJECT",
+        "properties": {name: {"type": "STRING"} for name in ("dockerfile", "compose", "github_action")},
+        "required": ["dockerfile", "compose", "github_action"],
+        "propertyOrdering": ["dockerfile", "compose", "github_action"],
+    }
+    # Output tokens per project; billed and generated serially, so this caps both cost and latency
+    GEMINI_MAX_OUTPUT_TOKENS = int(os.getenv("GEMINI_MAX_OUTPUT_TOKENS", "3000"))
+    # Only for models that think: thinking tokens count against maxOutputTokens, so the
+    # budget is set explicitly and added on top, and the reply keeps its full cap. Unset
+    # sends no thinkingConfig, which models without thinking reject.
+    GEMINI_THINKING_BUDGET = int(os.environ["GEMINI_THINKING_BUDGET"]) if os.getenv("GEMINI_THINKING_BUDGET") else None
+    # Shared by every single-project request; JSON mode means Gemini replies with bare JSON
+    GEMINI_GENERATION_CONFIG = {
+        "temperature": 0.1,
+        "maxOutputTokens": GEMINI_MAX_OUTPUT_TOKENS + (GEMINI_THINKING_BUDGET or 0),
+        "responseMimeType": "application/json",
+        "responseSchema": DEVOPS_FILES_SCHEMA,
+        # Newlines inside the file contents are escaped in JSON, so a run of raw ones is the
+        # model padding whitespace; stop there instead of spending the rest of the budget
+        "stopSequences": ["\n\n\n\n"],
+    }
+    if GEMINI_THINKING_BUDGET is not None:
+        GEMINI_GENERATION_CONFIG["thinkingConfig"] = {"thinkingBudget": GEMINI_THINKING_BUDGET}
+
+    # Background job processing: N workers drain a bounded in-process queue
+    WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "8"))
+    # A worker that finds a backlog takes up to this many jobs and sends them as one Gemini call
+    GEMINI_BATCH_MAX = int(os.getenv("GEMINI_BATCH_MAX", "4"))
+    # Threads for blocking Redis job-store calls made after generation
+    JOB_STORE_THREADS = int(os.getenv("JOB_STORE_THREADS", "4"))
+    # Gemini requests per minute across all callers in this process; 0 means no limit
+    GEMINI_RPM = int(os.getenv("GEMINI_RPM", "0"))
+    JOB_QUEUE_MAXSIZE = 1024
+    JOB_STREAM_TIMEOUT_SECONDS = 240.0  # stays under Vercel's maxDuration of 300
+
+    # Environment configuration, resolved once at import rather than per request
+    LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "120.0"))
+    # Gemini API key (kept as OPENAI_API_KEY for compatibility)
+    GEMINI_API_KEY = os.getenv("OPENAI_API_KEY")
+    # Set by the Vercel runtime; no background work survives a response there
+    ON_VERCEL = bool(os.getenv("VERCEL"))
+
+    def parse_cors_origins():
+        """Split CORS_ALLOWED_ORIGINS into exact origins and 'regex:' patterns."""
+        origins_str = os.getenv("CORS_ALLOWED_ORIGINS", "").strip()
+        if not origins_str:
+            return [], []
+        regular = []
+        regex = []
+        for o in origins_str.split(","):
+            o = o.strip()
+            if not o:
+                continue
+            if o == "*":
+                regular.append(o)
+            elif o.startswith(("http://", "https://")):
+                regular.append(o.rstrip("/"))
+            elif o.startswith("regex:"):
+                p = o[6:].strip()
+                if not p:
+                    continue
+                # Drop invalid patterns here; otherwise CORSMiddleware fails to build the app
+                try:
+                    re.compile(p)
+                except re.error as e:
+                    logger.warning(f"Ignoring invalid CORS origin regex {p!r}: {e}")
+                    continue
+                regex.append(p)
+        return regular, regex
+
+    CORS_ORIGINS, CORS_ORIGIN_REGEXES = parse_cors_origins()
+    # Combined pattern, built once; Starlette compiles it once per middleware instance
+    CORS_ORIGIN_REGEX = "|".join(f"(?:{p})" for p in CORS_ORIGIN_REGEXES) if CORS_ORIGIN_REGEXES else None
+    CORS_ALLOW_CREDENTIALS = os.getenv("CORS_ALLOW_CREDENTIALS", "true").lower() == "true"
+    # Seconds browsers may cache a preflight; Starlette's default of 600 re-sends OPTIONS every 10 minutes
+    CORS_MAX_AGE = int(os.getenv("CORS_MAX_AGE", "86400"))
+
+    def build_cors_config() -> Dict[str, Any]:
+        """CORSMiddleware options from the parsed CORS settings."""
+        regular_origins = list(CORS_ORIGINS)
+        cors_creds = CORS_ALLOW_CREDENTIALS
+        # Credentials can't be combined with a wildcard origin
+        if cors_creds and (not regular_origins and not CORS_ORIGIN_REGEXES or "*" in regular_origins):
+            cors_creds = False
+        if not regular_origins and not CORS_ORIGIN_REGEXES and not cors_creds:
+            regular_origins = ["*"]
+
+        cors_config = {"allow_credentials": cors_creds, "allow_methods": ["*"], "allow_headers": ["*"], "max_age": CORS_MAX_AGE}
+        if regular_origins:
+            cors_config["allow_origins"] = regular_origins
+        if CORS_ORIGIN_REGEX:
+            cors_config["allow_origin_regex"] = CORS_ORIGIN_REGEX
+        return cors_config
+
+    CORS_CONFIG = build_cors_config()
+
+    SYSTEM_PROMPT = """You are 'Spectra', an expert DevOps engineer. Generate production-ready DevOps files for the project described in the user message.
+
+Return ONLY valid JSON with keys: dockerfile, compose, github_action."""
+    # Rough size check at ~4 characters per token; a prompt under the minimum goes inline
+    SYSTEM_PROMPT_CACHEABLE = GEMINI_CONTEXT_CACHE and len(SYSTEM_PROMPT) // 4 >= GEMINI_CACHE_MIN_TOKENS
+
+    # Static pieces of the per-request prompt: "Project: <stack>\nFiles:\n<file blocks>"
+    USER_PROMPT_PREFIX = "Project: "
+    USER_PROMPT_FILES_HEADER = "\nFiles:\n"
+
+    def build_user_prompt(stack: str, files: Dict[str, str]) -> str:
+        """Build the per-request prompt with one str.join, which sizes the result up front."""
+        parts = [USER_PROMPT_PREFIX, stack, USER_PROMPT_FILES_HEADER]
+        sep = ""
+        for name, content in files.items():
+            parts += (sep, "--- ", name, " ---\n", content, "\n")
+            sep = "\n"
+        return "".join(parts)
+
+    # Prepended to the concatenated per-project prompts of a batched request
+    BATCH_PROMPT_HEADER = (
+        "Generate DevOps files for each of the {count} projects below. Respond with a JSON "
+        "array of {count} objects, in the same order as the projects, each with the keys "
+        "dockerfile, compose and github_action.\n"
+    )
+
+    class RateLimiter:
+        """Spaces calls evenly so at most `per_minute` start in any minute; 0 disables it."""
+
+        def __init__(self, per_minute: int):
+            self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+            self._next_slot = 0.0
+
+        async def acquire(self):
+            if not self.interval:
+                return
+            now = asyncio.get_running_loop().time()
+            slot = max(self._next_slot, now)
+            # Reserve the slot before sleeping so concurrent callers queue up behind it
+            self._next_slot = slot + self.interval
+            if slot > now:
+                await asyncio.sleep(slot - now)
+
+    # A top-level "key": " opener at the scan position, after an optional { or ,
+    JSON_FIELD_RE = re.compile(r'\s*[{,]?\s*"(dockerfile|compose|github_action)"\s*:\s*"')
+
+    class JSONFieldScanner:
+        """Picks completed DevOpsFiles fields out of a JSON object as it streams in."""
+
+        def __init__(self):
+            self.text = ""
+            self.pos = -1
+
+        def feed(self, chunk: str) -> List[tuple]:
+            """Add a chunk of model output; return (field, value) pairs completed by it."""
+            self.text += chunk
+            if self.pos < 0:
+                # Skip any ``` fence before the object starts
+                self.pos = self.text.find("{")
+                if self.pos < 0:
+                    return []
+            done = []
+            while True:
+                m = JSON_FIELD_RE.match(self.text, self.pos)
+                if not m:
+                    return done
+                try:
+                    value, end = json.decoder.scanstring(self.text, m.end())
+                except ValueError:
+                    # Value still incomplete; wait for more output
+                    return done
+                done.append((m.group(1), value))
+                self.pos = end
+
+    def strip_json_fences(text: str) -> str:
+        """Return the body of a response wrapped in ``` or ```json fences, else text stripped."""
+        text = text.strip()
+        if text.startswith("```"):
+            text = text[7:] if text.startswith("```json") else text[3:]
+            if text.endswith("```"):
+                text = text[:-3]
+            text = text.strip()
+        return text
+
     # Add api directory to path
     try:
         api_dir = os.path.dirname(os.path.abspath(__file__))
@@ -94,47 +311,45 @@ try:
             def __init__(self, **kwargs):
                 for k, v in kwargs.items():
                     setattr(self, k, v)
-            def dict(self):
+            def model_dump(self):
                 return {k: v for k, v in self.__dict__.items() if not k.startswith('_')}
+            dict = model_dump
+            @classmethod
+            def model_construct(cls, **kwargs):
+                return cls(**kwargs)
 
     # Import FastAPI
     FALLBACK_MODE = False
     FastAPI = None
     HTTPException = None
+    Response = None
     CORSMiddleware = None
+    StreamingResponse = None
     try:
-        from fastapi import FastAPI, HTTPException
+        from fastapi import FastAPI, HTTPException, Request, Response
+        from fastapi.exceptions import RequestValidationError
         from fastapi.middleware.cors import CORSMiddleware
+        from fastapi.responses import StreamingResponse
+        from pydantic import ValidationError
     except Exception as e:
         FALLBACK_MODE = True
         logger.error(f"FastAPI import failed: {e}")
 
-    # Import local modules - use safe import for each
-    ProjectContext = None
-    DevOpsFiles = None
-    JobResponse = None
-    JobStatus = None
-    get_template = None
-    create_job = None
-    get_job = None
-    update_job_status = None
-
-    # Try importing models
-    try:
-        models_module = _safe_import('models')
-        if models_module:
-            ProjectContext = getattr(models_module, 'ProjectContext', None)
-            DevOpsFiles = getattr(models_module, 'DevOpsFiles', None)
-            JobResponse = getattr(models_module, 'JobResponse', None)
-            JobStatus = getattr(models_module, 'JobStatus', None)
-            if all([ProjectContext, DevOpsFiles, JobResponse, JobStatus]):
-                logger.info("Imported models successfully")
-            else:
+    # Import local modules - use safe import for each, with a fallback if it fails
+    def _import_models():
+        """(model classes..., MAX_CONTEXT_CHARS) from models.py, or minimal stand-ins if it can't be loaded."""
+        try:
+            models_module = _safe_import('models')
+            if not models_module:
+                raise ImportError("Could not load models module")
+            classes = tuple(getattr(models_module, name, None) for name in ('ProjectContext', 'DevOpsFiles', 'JobResponse', 'JobStatus'))
+            if not all(classes):
                 raise AttributeError("Missing model classes")
-        else:
-            raise ImportError("Could not load models module")
-    except Exception as e:
-        logger.error(f"Failed to import models: {e}")
+            logger.info("Imported models successfully")
+            return classes + (models_module.MAX_CONTEXT_CHARS,)
+        except Exception as e:
+            logger.error(f"Failed to import models: {e}")
+
         class ProjectContext(BaseModel):
             stack: str = "unknown"
             files: Dict[str, str] = {}
@@ -150,136 +365,332 @@ try:
             status: str = "pending"
             result: Optional[DevOpsFiles] = None
             error: Optional[str] = None
-    
-    # Try importing templates - this is the risky one
-    try:
-        templates_module = _safe_import('templates')
-        if templates_module:
-            get_template = getattr(templates_module, 'get_template', None)
-            if get_template:
-                logger.info("Imported templates successfully")
-            else:
+        # Same total-upload limit as models.py, for the 413 check
+        max_context_chars = 1_000_000
+        return ProjectContext, DevOpsFiles, JobResponse, JobStatus, max_context_chars
+
+    def _import_templates():
+        """(get_template, stacks with a template) from templates.py, or a lookup that finds nothing."""
+        try:
+            templates_module = _safe_import('templates')
+            if not templates_module:
+                raise ImportError("Could not load templates module")
+            lookup = getattr(templates_module, 'get_template', None)
+            if not lookup:
                 raise AttributeError("get_template not found")
-        else:
-            raise ImportError("Could not load templates module")
-    except Exception as e:
-        logger.error(f"Failed to import templates: {e}")
-        logger.error(traceback.format_exc())
+            logger.info("Imported templates successfully")
+            # Templates are immutable, so lookups can be memoized per stack
+            return functools.lru_cache(maxsize=128)(lookup), frozenset(getattr(templates_module, 'TEMPLATES', {})) | frozenset(getattr(templates_module, 'STACK_ALIASES', {}))
+        except Exception as e:
+            logger.error(f"Failed to import templates: {e}")
+            logger.error(traceback.format_exc())
+
         def get_template(stack):
             return None
+        return get_template, frozenset()
 
-    # Try importing job_queue
-    try:
-        job_queue_module = _safe_import('job_queue')
-        if job_queue_module:
-            create_job = getattr(job_queue_module, 'create_job', None)
-            get_job = getattr(job_queue_module, 'get_job', None)
-            update_job_status = getattr(job_queue_module, 'update_job_status', None)
-            if all([create_job, get_job, update_job_status]):
-                logger.info("Imported job_queue successfully")
-            else:
+    def _import_job_queue():
+        """(module, create_job, get_job, claim_job, update_job_status, wait_for_job) from job_queue.py, or stubs."""
+        try:
+            module = _safe_import('job_queue')
+            if not module:
+                raise ImportError("Could not load job_queue module")
+            functions = tuple(getattr(module, name, None) for name in ('create_job', 'get_job', 'claim_job', 'update_job_status'))
+            if not all(functions):
                 raise AttributeError("Missing job_queue functions")
-        else:
-            raise ImportError("Could not load job_queue module")
-    except Exception as e:
-        logger.error(f"Failed to import job_queue: {e}")
+            logger.info("Imported job_queue successfully")
+            return (module,) + functions + (getattr(module, 'wait_for_job', None),)
+        except Exception as e:
+            logger.error(f"Failed to import job_queue: {e}")
+
         def create_job(context):
             raise RuntimeError("Job creation unavailable")
         def get_job(job_id):
             return None
-        def update_job_status(job_id, status, result=None, error=None):
+        def claim_job(job_id):
+            return False, None
+        def update_job_status(job_id, status, result=None, error=None, only_if=None):
             pass
+        return None, create_job, get_job, claim_job, update_job_status, None
+
+    def _import_response_cache():
+        """LLMCache instance from llm_cache.py - optional, generation works without it."""
+        try:
+            llm_cache_module = _safe_import('llm_cache')
+            if not (llm_cache_module and hasattr(llm_cache_module, 'LLMCache')):
+                raise ImportError("Could not load llm_cache module")
+            logger.info("Imported llm_cache successfully")
+            return llm_cache_module.LLMCache()
+        except Exception as e:
+            logger.error(f"Failed to import llm_cache: {e}")
+            return None
+
+    # MAX_CONTEXT_CHARS: total upload size accepted by POST / and POST /jobs
+    ProjectContext, DevOpsFiles, JobResponse, JobStatus, MAX_CONTEXT_CHARS = _import_models()
+    # KNOWN_STACKS: stacks with a template; anything else goes straight to the job queue
+    get_template, KNOWN_STACKS = _import_templates()
+    job_queue_module, create_job, get_job, claim_job, update_job_status, wait_for_job = _import_job_queue()
+    response_cache = _import_response_cache()
+
+    # Templates never change, so their JSON responses are serialized once up front
+    TEMPLATE_BODIES: Dict[str, bytes] = {}
+    for _stack in KNOWN_STACKS:
+        try:
+            TEMPLATE_BODIES[_stack] = _dumps(get_template(_stack).model_dump())
+        except Exception as e:
+            logger.warning(f"Could not pre-serialize template for {_stack}: {e}")
+
+    def lookup_template_body(stack: str) -> Optional[bytes]:
+        """Pre-serialized template JSON for a known stack, or None."""
+        return TEMPLATE_BODIES.get(stack) or TEMPLATE_BODIES.get(stack.lower())
+
+    # Every fixed part of the prompt, so editing any of them invalidates cached responses
+    PROMPT_TEMPLATE = SYSTEM_PROMPT + USER_PROMPT_PREFIX + USER_PROMPT_FILES_HEADER
+    # Gemini's systemInstruction for SYSTEM_PROMPT, shared by every request that sends it inline
+    SYSTEM_INSTRUCTION = {"parts": [{"text": SYSTEM_PROMPT}]}
 
     # Initialize app
-    _mangum_available = False
+    # Mangum adapter for Lambda-style handler() calls - imported on first use, since
+    # Vercel serves the ASGI app directly and most cold starts never need it
     mangum_handler = None
 
+    def get_mangum_handler():
+        """Return the Mangum adapter for app, or None if mangum isn't installed."""
+        global mangum_handler
+        if mangum_handler is None:
+            try:
+                from mangum import Mangum
+                mangum_handler = Mangum(app, lifespan="off")
+            except Exception:
+                mangum_handler = False
+        return mangum_handler or None
+
     if not FALLBACK_MODE and FastAPI:
         try:
-            app = FastAPI(title="Spectra API", description="AI-powered DevOps file generator", version="0.2.0")
-
-            def parse_cors_origins():
-                origins_str = os.getenv("CORS_ALLOWED_ORIGINS", "").strip()
-                if not origins_str:
-                    return [], []
-                regular = []
-                regex = []
-                for o in origins_str.split(","):
-                    o = o.strip()
-                    if not o:
-                        continue
-                    if o == "*":
-                        regular.append(o)
-                    elif o.startswith(("http://", "https://")):
-                        regular.append(o.rstrip("/"))
-                    elif o.startswith("regex:"):
-                        p = o[6:].strip()
-                        if p:
-                            regex.append(p)
-                return regular, regex
-
-            regular_origins, regex_origins = parse_cors_origins()
-            cors_creds = os.getenv("CORS_ALLOW_CREDENTIALS", "true").lower() == "true"
-            if cors_creds and (not regular_origins and not regex_origins or "*" in regular_origins):
-                cors_creds = False
-            if not regular_origins and not regex_origins and not cors_creds:
-                regular_origins = ["*"]
-
-            cors_config = {"allow_credentials": cors_creds, "allow_methods": ["*"], "allow_headers": ["*"]}
-            if regular_origins:
-                cors_config["allow_origins"] = regular_origins
-            if regex_origins:
-                cors_config["allow_origin_regex"] = "|".join(f"({p})" for p in regex_origins)
-
-            app.add_middleware(CORSMiddleware, **cors_config)
+            app_options = {}
+            if orjson:
+                from fastapi.responses import ORJSONResponse
+                app_options["default_response_class"] = ORJSONResponse
+            app = FastAPI(title="Spectra API", description="AI-powered DevOps file generator", version="0.2.0", **app_options)
+
+            app.add_middleware(CORSMiddleware, **CORS_CONFIG)
+
+            # Handle of the explicit context cache holding SYSTEM_PROMPT
+            app.state.gemini_cache = None
+            app.state.gemini_cache_expires_at = 0.0
+            gemini_cache_lock = asyncio.Lock()
+            # Job queue and workers, created on startup when running as a long-lived server
+            app.state.jobq = None
+            app.state.job_workers = []
+            # Job IDs waiting in jobq, so a job enqueued at creation isn't queued twice
+            app.state.queued_jobs = set()
+            # Caps concurrent Gemini calls, whether made by workers or inline
+            llm_semaphore = asyncio.Semaphore(WORKER_CONCURRENCY)
+            # Keeps bursts under the Gemini per-minute quota instead of failing them with 429s
+            gemini_limiter = RateLimiter(GEMINI_RPM)
+            # Identical requests currently being generated, keyed like the response cache
+            app.state.inflight = {}
+
+            # Shared async HTTP client for the Gemini REST API, created on first use
+            gemini_http = None
 
             def get_gemini_client():
-                import google.genai as genai
-                key = os.getenv("OPENAI_API_KEY")
+                """Return the shared Gemini HTTP client, creating it on first use."""
+                global gemini_http
+                key = GEMINI_API_KEY
                 if not key:
                     raise ValueError("OPENAI_API_KEY not set")
-                genai.configure(api_key=key)
-                return genai.GenerativeModel('gemini-1.5-flash')
+                if gemini_http is None:
+                    import httpx
+                    # The overall deadline is enforced with asyncio.wait_for by the caller
+                    gemini_http = httpx.AsyncClient(
+                        base_url=GEMINI_API_BASE,
+                        http2=True,
+                        timeout=httpx.Timeout(None, connect=10.0),
+                        # Jobs often arrive more than httpx's default 5s apart; keep the
+                        # warm HTTP/2 connection around so they skip the TLS handshake
+                        limits=httpx.Limits(max_connections=WORKER_CONCURRENCY * 2, keepalive_expiry=120.0),
+                        headers={"x-goog-api-key": key}
+                    )
+                return gemini_http
 
-            async def get_llm_response(context: ProjectContext, timeout: float = 120.0) -> DevOpsFiles:
+            async def get_system_prompt_cache(client) -> Optional[str]:
+                """Return the cached-content name for SYSTEM_PROMPT, re-creating it before the TTL lapses.
+
+                Refreshing on use rather than from a background task keeps this working on
+                serverless hosts, where nothing runs between invocations. Returns None when
+                caching is unavailable, in which case the prompt is sent inline.
+                """
+                if not SYSTEM_PROMPT_CACHEABLE:
+                    return None
+                if time.time() < app.state.gemini_cache_expires_at - GEMINI_CACHE_REFRESH_MARGIN:
+                    return app.state.gemini_cache
+                async with gemini_cache_lock:
+                    now = time.time()
+                    if now < app.state.gemini_cache_expires_at - GEMINI_CACHE_REFRESH_MARGIN:
+                        return app.state.gemini_cache
+                    try:
+                        resp = await client.post("cachedContents", json={
+                            "model": f"models/{GEMINI_MODEL}",
+                            "systemInstruction": SYSTEM_INSTRUCTION,
+                            "ttl": f"{GEMINI_CACHE_TTL_SECONDS}s"
+                        }, timeout=GEMINI_CACHE_CREATE_TIMEOUT)
+                        resp.raise_for_status()
+                        app.state.gemini_cache = _loads(resp.content)["name"]
+                        app.state.gemini_cache_expires_at = now + GEMINI_CACHE_TTL_SECONDS
+                        logger.info(f"Created Gemini context cache {app.state.gemini_cache}")
+                    except Exception as e:
+                        # Don't retry on every request; try again after the refresh margin
+                        logger.warning(f"Gemini context caching unavailable, sending system prompt inline: {e}")
+                        app.state.gemini_cache = None
+                        app.state.gemini_cache_expires_at = now + 2 * GEMINI_CACHE_REFRESH_MARGIN
+                    return app.state.gemini_cache
+
+            def prepare_prompt(stack: str, files: Dict[str, str]) -> tuple:
+                """Build the user prompt and the response cache key."""
+                key = None
+                if response_cache:
+                    key = response_cache.cache_key(stack, files, PROMPT_TEMPLATE, GEMINI_MODEL)
+                return build_user_prompt(stack, files), key
+
+            async def build_gemini_body(client, prompt: str, batch_size: int = 0) -> Dict[str, Any]:
+                """Request body for generateContent / streamGenerateContent; batch_size > 0 asks for an array."""
+                config = GEMINI_GENERATION_CONFIG
+                if batch_size:
+                    config = {
+                        **config,
+                        "maxOutputTokens": config["maxOutputTokens"] * batch_size,
+                        "responseSchema": {"type": "ARRAY", "items": DEVOPS_FILES_SCHEMA, "minItems": batch_size, "maxItems": batch_size},
+                    }
+                body = {"contents": [{"role": "user", "parts": [{"text": prompt}]}], "generationConfig": config}
+                cache_name = await get_system_prompt_cache(client)
+                if cache_name:
+                    body["cachedContent"] = cache_name
+                else:
+                    body["systemInstruction"] = SYSTEM_INSTRUCTION
+                return body
+
+            def gemini_retry_delay(resp, attempt: int) -> float:
+                """Seconds to wait before retrying: Gemini's hint if it gave one, else exponential backoff."""
+                delay = 0.5 * 2 ** attempt
+                if resp is None:
+                    return delay
+                hint = resp.headers.get("retry-after")
+                if hint is None and resp.status_code == 429:
+                    # Quota errors carry the wait in a google.rpc.RetryInfo detail, e.g. "13s"
+                    try:
+                        for detail in _loads(resp.content)["error"]["details"]:
+                            if detail.get("@type", "").endswith("RetryInfo"):
+                                hint = detail["retryDelay"].rstrip("s")
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        pass
                 try:
-                    model = get_gemini_client()
+                    return min(max(float(hint), delay), GEMINI_RETRY_DELAY_MAX) if hint is not None else delay
                 except ValueError:
-                    raise HTTPException(status_code=500, detail="API key not configured")
+                    return delay
 
-                files_str = "\n".join([f"--- {f} ---\n{c}\n" for f, c in context.files.items()])
-                prompt = f"""You are 'Spectra', an expert DevOps engineer. Generate production-ready DevOps files.
+            async def post_generate_content(client, body: Dict[str, Any]):
+                """POST generateContent, retrying transient failures; callers bound the total time."""
+                import httpx
+                for attempt in range(GEMINI_MAX_ATTEMPTS):
+                    last = attempt == GEMINI_MAX_ATTEMPTS - 1
+                    resp = None
+                    try:
+                        resp = await client.post(f"models/{GEMINI_MODEL}:generateContent", json=body)
+                    except httpx.TransportError as e:
+                        if last:
+                            raise
+                        logger.warning(f"Gemini request failed ({e!r}), retrying")
+                    else:
+                        if last or resp.status_code not in GEMINI_RETRY_STATUSES:
+                            resp.raise_for_status()
+                            return resp
+                        logger.warning(f"Gemini returned {resp.status_code}, retrying")
+                    await asyncio.sleep(gemini_retry_delay(resp, attempt))
+                    # A retry is another request against the per-minute quota
+                    await gemini_limiter.acquire()
+
+            def gemini_response_text(resp) -> str:
+                """Text of the first candidate in a generateContent response."""
+                # Decoded with _loads (orjson) rather than resp.json(), which uses stdlib json
+                try:
+                    return _loads(resp.content)["candidates"][0]["content"]["parts"][0]["text"].strip()
+                except (KeyError, IndexError, TypeError):
+                    raise ValueError("Invalid Gemini response")
 
-Project: {context.stack}
-Files:
-{files_str}
+            def parse_llm_json(text):
+                """Parse model output as JSON, stripping ``` fences if present."""
+                if isinstance(text, (bytes, bytearray)):
+                    text = text.decode()
+                return _loads(strip_json_fences(text))
 
-Return ONLY valid JSON with keys: dockerfile, compose, github_action."""
+            def parse_devops_files(text) -> DevOpsFiles:
+                """Parse the model output (optionally fenced) into DevOpsFiles."""
+                data = parse_llm_json(text)
+                return DevOpsFiles(dockerfile=data.get('dockerfile'), compose=data.get('compose'), github_action=data.get('github_action'))
+
+            async def stream_gemini_text(client, prompt: str):
+                """Yield text chunks from streamGenerateContent as Gemini produces them."""
+                body = await build_gemini_body(client, prompt)
+                async with client.stream("POST", f"models/{GEMINI_MODEL}:streamGenerateContent", params={"alt": "sse"}, json=body) as resp:
+                    resp.raise_for_status()
+                    async for line in resp.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        try:
+                            parts = _loads(line[5:])["candidates"][0]["content"]["parts"]
+                        except (KeyError, IndexError, TypeError, ValueError):
+                            continue
+                        for part in parts:
+                            if part.get("text"):
+                                yield part["text"]
+
+            async def get_llm_response(context: ProjectContext, timeout: float = 120.0) -> DevOpsFiles:
+                # A few milliseconds even at MAX_CONTEXT_CHARS, so it stays on the loop
+                prompt, cache_key = prepare_prompt(context.stack, context.files)
+
+                if cache_key:
+                    cached = await response_cache.get(cache_key)
+                    if cached:
+                        logger.info(f"LLM cache hit for stack {context.stack}")
+                        return DevOpsFiles.model_construct(**cached)
+
+                # Coalesce concurrent misses for the same context into one Gemini call
+                inflight_key = cache_key or hashlib.sha256(prompt.encode()).hexdigest()
+                task = app.state.inflight.get(inflight_key)
+                if task is None:
+                    task = asyncio.ensure_future(_generate_response(prompt, cache_key, timeout))
+                    app.state.inflight[inflight_key] = task
+                    task.add_done_callback(lambda t: app.state.inflight.pop(inflight_key, None) if app.state.inflight.get(inflight_key) is t else None)
+                else:
+                    logger.info(f"Joining in-flight generation for stack {context.stack}")
+                # Shielded so one caller disconnecting doesn't cancel it for the others
+                return await asyncio.shield(task)
+
+            async def _generate_response(prompt: str, cache_key: Optional[str], timeout: float) -> DevOpsFiles:
+                try:
+                    client = get_gemini_client()
+                except ValueError:
+                    raise HTTPException(status_code=500, detail="API key not configured")
 
-                def _call_sync():
+                async def _generate() -> str:
                     try:
-                        resp = model.generate_content(prompt, generation_config={"temperature": 0.1, "max_output_tokens": 3000})
-                        if not resp or not hasattr(resp, 'text'):
-                            raise ValueError("Invalid Gemini response")
-                        return resp.text.strip()
+                        body = await build_gemini_body(client, prompt)
+                        resp = await post_generate_content(client, body)
+                        return gemini_response_text(resp)
                     except Exception as e:
                         logger.error(f"Gemini error: {e}")
                         raise
-                
+
                 try:
-                    if hasattr(asyncio, 'to_thread'):
-                        text = await asyncio.wait_for(asyncio.to_thread(_call_sync), timeout=timeout)
-                    else:
-                        loop = asyncio.get_event_loop()
-                        text = await asyncio.wait_for(loop.run_in_executor(None, _call_sync), timeout=timeout)
-                    
-                    if text.startswith("```json"):
-                        text = text.replace("```json", "").replace("```", "").strip()
-                    elif text.startswith("```"):
-                        text = text.replace("```", "").strip()
-                    
-                    data = json.loads(text)
-                    return DevOpsFiles(dockerfile=data.get('dockerfile'), compose=data.get('compose'), github_action=data.get('github_action'))
+                    async with llm_semaphore:
+                        await gemini_limiter.acquire()
+                        text = await asyncio.wait_for(_generate(), timeout=timeout)
+
+                    result = parse_devops_files(text)
+                    if cache_key:
+                        await response_cache.set(cache_key, result.model_dump())
+                    return result
                 except asyncio.TimeoutError:
                     raise HTTPException(status_code=504, detail=f"Timeout after {timeout}s")
                 except json.JSONDecodeError as e:
@@ -287,136 +698,486 @@ Return ONLY valid JSON with keys: dockerfile, compose, github_action."""
                 except Exception as e:
                     raise HTTPException(status_code=500, detail=f"AI error: {str(e)}")
 
-            @app.post("/")
-            async def generate_devops(context: ProjectContext):
+            async def get_llm_batch_response(contexts: List[ProjectContext]) -> List[DevOpsFiles]:
+                """
+                Generate files for several projects with a single Gemini call.
+
+                Cached projects are answered from the cache. Raises if the response
+                is not a JSON array with exactly one object per uncached project,
+                so the caller can fall back to one call per project.
+                """
+                prepared = [prepare_prompt(c.stack, c.files) for c in contexts]
+                results: List[Optional[DevOpsFiles]] = [None] * len(contexts)
+                misses = []
+                for i, (_, key) in enumerate(prepared):
+                    cached = await response_cache.get(key) if key else None
+                    if cached:
+                        results[i] = DevOpsFiles.model_construct(**cached)
+                    else:
+                        misses.append(i)
+
+                if len(misses) == 1:
+                    results[misses[0]] = await get_llm_response(contexts[misses[0]], timeout=LLM_TIMEOUT_SECONDS)
+                elif misses:
+                    parts = [BATCH_PROMPT_HEADER.format(count=len(misses))]
+                    for n, i in enumerate(misses, 1):
+                        parts += (f"\n### Project {n}\n", prepared[i][0])
+
+                    client = get_gemini_client()
+
+                    async def _generate_batch():
+                        body = await build_gemini_body(client, "".join(parts), batch_size=len(misses))
+                        return await post_generate_content(client, body)
+
+                    # One reply holds every project's files and is generated serially, so
+                    # allow each project the time a single call gets
+                    async with llm_semaphore:
+                        await gemini_limiter.acquire()
+                        resp = await asyncio.wait_for(_generate_batch(), timeout=LLM_TIMEOUT_SECONDS * len(misses))
+                    items = parse_llm_json(gemini_response_text(resp))
+                    if not isinstance(items, list) or len(items) != len(misses):
+                        raise ValueError(f"Expected a JSON array of {len(misses)} results")
+
+                    for i, item in zip(misses, items):
+                        result = DevOpsFiles(dockerfile=item.get('dockerfile'), compose=item.get('compose'), github_action=item.get('github_action'))
+                        results[i] = result
+                        key = prepared[i][1]
+                        if key:
+                            await response_cache.set(key, result.model_dump())
+                return results
+
+            def check_context_size(context: ProjectContext):
+                """Reject uploads whose files add up to more than MAX_CONTEXT_CHARS with a 413."""
+                total = sum(len(c) for c in context.files.values())
+                if total > MAX_CONTEXT_CHARS:
+                    raise HTTPException(status_code=413, detail=f"Project files total {total} characters; the limit is {MAX_CONTEXT_CHARS}")
+
+            # The routes below read the body themselves, so document it for /docs explicitly
+            CONTEXT_REQUEST_BODY = {"requestBody": {"required": True, "content": {"application/json": {"schema": ProjectContext.model_json_schema()}}}}
+
+            async def read_context(request: Request) -> tuple:
+                """
+                Parse a ProjectContext body, answering template stacks before any validation.
+
+                Returns (template_body, None) when the stack has a template, so the files -
+                usually most of the body - are never validated; otherwise (None, context).
+                """
+                raw = await request.body()
+                try:
+                    data = _loads(raw)
+                except json.JSONDecodeError as e:
+                    # Same shape as FastAPI's own error for an unparseable body
+                    raise RequestValidationError([{"type": "json_invalid", "loc": ("body", e.pos), "msg": "JSON decode error", "input": {}, "ctx": {"error": e.msg}}])
+                if isinstance(data, dict) and isinstance(data.get("stack"), str):
+                    body = lookup_template_body(data["stack"])
+                    if body:
+                        return body, None
                 try:
-                    template = get_template(context.stack) if get_template else None
-                    if template:
-                        return template.dict() if hasattr(template, 'dict') else dict(template)
-                    ctx_dict = context.dict() if hasattr(context, 'dict') else dict(context)
-                    job_id = create_job(ctx_dict) if create_job else str(uuid.uuid4())
+                    context = ProjectContext.model_validate(data)
+                except ValidationError as e:
+                    raise RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)])
+                check_context_size(context)
+                return None, context
+
+            @app.post("/", openapi_extra=CONTEXT_REQUEST_BODY)
+            async def generate_devops(request: Request, stream: bool = False):
+                body, context = await read_context(request)
+                if body:
+                    return Response(content=body, media_type="application/json")
+                try:
+                    ctx_dict = context.model_dump()
+                    job_id = await run_job_store(create_job, ctx_dict) if create_job else str(uuid.uuid4())
+                    # Start right away where workers exist; the client's /process call then just
+                    # confirms. ?stream=1 leaves the job for POST /process/{job_id}/stream to run.
+                    if not stream:
+                        enqueue_job(job_id)
                     return {"job_id": job_id, "status": "pending"}
                 except Exception as e:
                     logger.error(f"generate_devops error: {e}")
                     raise HTTPException(status_code=500, detail=str(e))
 
-            @app.post("/jobs")
-            async def create_job_endpoint(context: ProjectContext):
+            @app.post("/jobs", openapi_extra=CONTEXT_REQUEST_BODY)
+            async def create_job_endpoint(request: Request, stream: bool = False):
+                body, context = await read_context(request)
+                if body:
+                    return Response(content=b'{"status":"completed","result":' + body + b"}", media_type="application/json")
                 try:
-                    template = get_template(context.stack) if get_template else None
-                    if template:
-                        return {"status": "completed", "result": template.dict() if hasattr(template, 'dict') else dict(template)}
-                    ctx_dict = context.dict() if hasattr(context, 'dict') else dict(context)
-                    job_id = create_job(ctx_dict) if create_job else str(uuid.uuid4())
+                    ctx_dict = context.model_dump()
+                    job_id = await run_job_store(create_job, ctx_dict) if create_job else str(uuid.uuid4())
+                    # Start right away where workers exist; the client's /process call then just
+                    # confirms. ?stream=1 leaves the job for POST /process/{job_id}/stream to run.
+                    if not stream:
+                        enqueue_job(job_id)
                     return JobResponse(job_id=job_id, status="pending")
                 except Exception as e:
                     raise HTTPException(status_code=500, detail=str(e))
 
             @app.get("/job/{job_id}")
-            async def get_job_status(job_id: str):
-                data = get_job(job_id) if get_job else None
+            async def get_job_status(job_id: str, request: Request):
+                data = await run_job_store(get_job, job_id)
                 if not data:
                     raise HTTPException(status_code=404, detail="Job not found")
-                result = None
-                if data.get("result"):
-                    try:
-                        result = DevOpsFiles(**data["result"])
-                    except Exception:
-                        result = None
-                return JobStatus(job_id=job_id, status=data.get("status", "unknown"), result=result, error=data.get("error"))
+                status = data.get("status", "unknown")
+                # Stored results were produced by DevOpsFiles.model_dump(), so they are
+                # serialized as-is instead of being re-validated through JobStatus
+                result = data.get("result")
+                body = _dumps({
+                    "job_id": job_id,
+                    "status": status,
+                    "result": result if isinstance(result, dict) else None,
+                    "error": data.get("error"),
+                })
+                # Status plus a digest of the body, so a changed result or error under the
+                # same status (e.g. a re-run job) never gets a 304 for the old one
+                headers = {"ETag": f'"{status}-{hashlib.sha1(body).hexdigest()[:16]}"', "Cache-Control": "no-cache"}
+                if headers["ETag"] in (tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")):
+                    return Response(status_code=304, headers=headers)
+                return Response(content=body, media_type="application/json", headers=headers)
 
-            @app.post("/process/{job_id}")
-            async def process_job(job_id: str):
-                data = get_job(job_id) if get_job else None
+            @app.get("/job/{job_id}/stream")
+            async def stream_job_status(job_id: str, timeout: float = JOB_STREAM_TIMEOUT_SECONDS):
+                """Server-Sent Events: the current status, then one final event on completion."""
+                data = await run_job_store(get_job, job_id) if get_job else None
                 if not data:
                     raise HTTPException(status_code=404, detail="Job not found")
-                if data.get("status") != "pending":
+                timeout = min(max(timeout, 0.0), JOB_STREAM_TIMEOUT_SECONDS)
+
+                def _event(name: str, job: Dict[str, Any]) -> bytes:
+                    payload = {
+                        "job_id": job_id,
+                        "status": job.get("status", "unknown"),
+                        "result": job.get("result"),
+                        "error": job.get("error"),
+                    }
+                    return b"event: " + name.encode() + b"\ndata: " + _dumps(payload) + b"\n\n"
+
+                async def _events():
+                    yield _event("status", data)
+                    if data.get("status") in ("completed", "failed"):
+                        yield _event("done", data)
+                        return
+                    final = await wait_for_job(job_id, timeout) if wait_for_job else None
+                    final = final or data
+                    done = final.get("status") in ("completed", "failed")
+                    yield _event("done" if done else "timeout", final)
+
+                return StreamingResponse(
+                    _events(),
+                    media_type="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                )
+
+            # Bounded pool for the blocking Redis client, so a slow round trip doesn't stall the loop
+            job_store_executor = None
+
+            async def run_job_store(fn, *args, **kwargs):
+                """
+                Call a job_queue function, on the job-store threads when it goes over the network.
+
+                The in-memory store is a dict update, cheaper than the thread hop, so it runs inline.
+                """
+                if not getattr(job_queue_module, "USE_REDIS", False):
+                    return fn(*args, **kwargs)
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(get_job_store_executor(), functools.partial(fn, *args, **kwargs))
+
+            def submit_job_store(fn, *args, **kwargs):
+                """Like run_job_store, without waiting for the result; for cleanup that can't await."""
+                if not getattr(job_queue_module, "USE_REDIS", False):
+                    fn(*args, **kwargs)
+                    return
+                get_job_store_executor().submit(fn, *args, **kwargs)
+
+            def get_job_store_executor() -> concurrent.futures.ThreadPoolExecutor:
+                """Return the job-store thread pool, creating it on first use."""
+                global job_store_executor
+                if job_store_executor is None:
+                    job_store_executor = concurrent.futures.ThreadPoolExecutor(max_workers=JOB_STORE_THREADS, thread_name_prefix="job-store")
+                return job_store_executor
+
+            def enqueue_job(job_id: str) -> bool:
+                """Hand a job to the worker pool; False if there is no pool or it is full."""
+                jobq = app.state.jobq
+                if jobq is None:
+                    return False
+                if job_id in app.state.queued_jobs:
+                    return True
+                try:
+                    jobq.put_nowait(job_id)
+                except asyncio.QueueFull:
+                    return False
+                app.state.queued_jobs.add(job_id)
+                return True
+
+            async def _process_one(job_id: str) -> Dict[str, Any]:
+                """Run the LLM for a pending job and record the outcome on the job."""
+                claimed, data = await run_job_store(claim_job, job_id)
+                if not data:
+                    raise HTTPException(status_code=404, detail="Job not found")
+                if not claimed:
                     return {"message": f"Job {data.get('status', 'unknown')}"}
-                if update_job_status:
-                    update_job_status(job_id, "processing")
                 try:
-                    ctx = ProjectContext(**data.get("context", {}))
-                    timeout = float(os.getenv("LLM_TIMEOUT_SECONDS", "120.0"))
-                    result = await get_llm_response(ctx, timeout=timeout)
-                    if update_job_status:
-                        update_job_status(job_id, "completed", result=result.dict() if hasattr(result, 'dict') else dict(result))
-                    return {"message": "Job processed", "job_id": job_id}
-                except HTTPException:
+                    # Stored contexts came from a validated request body; skip re-validation
+                    ctx = ProjectContext.model_construct(**data.get("context", {}))
+                except Exception as e:
+                    await run_job_store(update_job_status, job_id, "failed", error=str(e))
+                    raise HTTPException(status_code=500, detail=str(e))
+                await _run_job(job_id, ctx)
+                return {"message": "Job processed", "job_id": job_id}
+
+            async def _run_job(job_id: str, ctx: ProjectContext):
+                """Generate files for an already-claimed job and record the outcome."""
+                try:
+                    result = await get_llm_response(ctx, timeout=LLM_TIMEOUT_SECONDS)
+                    await run_job_store(update_job_status, job_id, "completed", result=result.model_dump())
+                except HTTPException as e:
+                    await run_job_store(update_job_status, job_id, "failed", error=str(e.detail))
                     raise
                 except Exception as e:
-                    if update_job_status:
-                        update_job_status(job_id, "failed", error=str(e))
+                    await run_job_store(update_job_status, job_id, "failed", error=str(e))
                     raise HTTPException(status_code=500, detail=str(e))
 
+            async def _process_batch(job_ids: List[str]):
+                """Claim several pending jobs and generate them with one Gemini call."""
+                claimed = []
+                claims = await asyncio.gather(*(run_job_store(claim_job, job_id) for job_id in job_ids))
+                for job_id, (is_claimed, data) in zip(job_ids, claims):
+                    if not is_claimed:
+                        continue
+                    try:
+                        claimed.append((job_id, ProjectContext.model_construct(**data.get("context", {}))))
+                    except Exception as e:
+                        await run_job_store(update_job_status, job_id, "failed", error=str(e))
+
+                if len(claimed) > 1:
+                    try:
+                        results = await get_llm_batch_response([ctx for _, ctx in claimed])
+                    except Exception as e:
+                        logger.warning(f"Batch of {len(claimed)} jobs failed, retrying individually: {e}")
+                    else:
+                        await asyncio.gather(*(
+                            run_job_store(update_job_status, job_id, "completed", result=result.model_dump())
+                            for (job_id, _), result in zip(claimed, results)
+                        ))
+                        return
+                # Single job, or the batch failed: one call per job
+                await asyncio.gather(*(_run_job(job_id, ctx) for job_id, ctx in claimed), return_exceptions=True)
+
+            async def _job_worker():
+                """Drain job IDs from app.state.jobq until cancelled."""
+                jobq = app.state.jobq
+                while True:
+                    job_ids = [await jobq.get()]
+                    # Only batch what is already waiting, so an idle server adds no latency
+                    while len(job_ids) < GEMINI_BATCH_MAX and not jobq.empty():
+                        job_ids.append(jobq.get_nowait())
+                    app.state.queued_jobs.difference_update(job_ids)
+                    try:
+                        if len(job_ids) == 1:
+                            await _process_one(job_ids[0])
+                        else:
+                            await _process_batch(job_ids)
+                    except Exception as e:
+                        # The failure is already recorded on the job
+                        logger.error(f"Worker failed to process jobs {job_ids}: {e}")
+                    finally:
+                        for _ in job_ids:
+                            jobq.task_done()
+
+            @app.on_event("startup")
+            async def start_job_workers():
+                # Connect to Redis now, so the first job request doesn't pay for it on the event loop
+                if job_queue_module:
+                    await asyncio.to_thread(job_queue_module.get_redis)
+                # Serverless invocations end with the response, so workers would never run there
+                if ON_VERCEL:
+                    return
+                app.state.jobq = asyncio.Queue(maxsize=JOB_QUEUE_MAXSIZE)
+                app.state.queued_jobs = set()
+                app.state.job_workers = [asyncio.create_task(_job_worker()) for _ in range(WORKER_CONCURRENCY)]
+                logger.info(f"Started {WORKER_CONCURRENCY} job workers")
+
+            @app.on_event("shutdown")
+            async def stop_job_workers():
+                global gemini_http, job_store_executor
+                for task in app.state.job_workers:
+                    task.cancel()
+                app.state.job_workers = []
+                if gemini_http is not None:
+                    await gemini_http.aclose()
+                    gemini_http = None
+                if job_store_executor is not None:
+                    job_store_executor.shutdown(wait=False)
+                    job_store_executor = None
+                if response_cache is not None:
+                    response_cache.close()
+
+            @app.post("/process/{job_id}")
+            async def process_job(job_id: str, response: Response):
+                jobq = app.state.jobq
+                if jobq is None:
+                    # No worker pool: process inline and answer when done
+                    return await _process_one(job_id)
+                data = await run_job_store(get_job, job_id) if get_job else None
+                if not data:
+                    raise HTTPException(status_code=404, detail="Job not found")
+                if data.get("status") != "pending":
+                    return {"message": f"Job {data.get('status', 'unknown')}"}
+                if not enqueue_job(job_id):
+                    raise HTTPException(status_code=503, detail="Job queue is full, retry later")
+                response.status_code = 202
+                return {"status": "queued", "job_id": job_id}
+
+            @app.post("/process/{job_id}/stream")
+            async def process_job_stream(job_id: str):
+                """Process a pending job, streaming Gemini output as Server-Sent Events."""
+                # Claimed before streaming starts, so a queued worker skips it
+                claimed, data = await run_job_store(claim_job, job_id)
+                if not data:
+                    raise HTTPException(status_code=404, detail="Job not found")
+                ctx = ProjectContext.model_construct(**data.get("context", {}))
+
+                def _sse(name: str, payload: bytes) -> bytes:
+                    return b"event: " + name.encode() + b"\ndata: " + payload + b"\n\n"
+
+                def _job_event(job: Dict[str, Any]) -> bytes:
+                    name = "done" if job.get("status") == "completed" else "error"
+                    return _sse(name, _dumps({"job_id": job_id, "status": job.get("status"), "result": job.get("result"), "error": job.get("error")}))
+
+                async def _events():
+                    if not claimed:
+                        # Already handled elsewhere: report the outcome once it is known
+                        job = await wait_for_job(job_id, JOB_STREAM_TIMEOUT_SECONDS) if wait_for_job else data
+                        yield _job_event(job or data)
+                        return
+
+                    error = None
+                    try:
+                        prompt, cache_key = prepare_prompt(ctx.stack, ctx.files)
+                        cached = await response_cache.get(cache_key) if cache_key else None
+                        if cached:
+                            result = DevOpsFiles.model_construct(**cached)
+                        else:
+                            try:
+                                client = get_gemini_client()
+                            except ValueError:
+                                raise HTTPException(status_code=500, detail="API key not configured")
+                            scanner = JSONFieldScanner()
+                            loop = asyncio.get_running_loop()
+                            deadline = loop.time() + LLM_TIMEOUT_SECONDS
+                            async with llm_semaphore:
+                                await gemini_limiter.acquire()
+                                chunks = stream_gemini_text(client, prompt)
+                                try:
+                                    while True:
+                                        try:
+                                            chunk = await asyncio.wait_for(chunks.__anext__(), timeout=max(deadline - loop.time(), 0))
+                                        except StopAsyncIteration:
+                                            break
+                                        yield _sse("chunk", _dumps(chunk))
+                                        for name, content in scanner.feed(chunk):
+                                            yield _sse("file", _dumps({"name": name, "content": content}))
+                                finally:
+                                    await chunks.aclose()
+                            result = parse_devops_files(scanner.text.strip())
+                            if cache_key:
+                                await response_cache.set(cache_key, result.model_dump())
+                        await run_job_store(update_job_status, job_id, "completed", result=result.model_dump())
+                    except HTTPException as e:
+                        error = str(e.detail)
+                    except json.JSONDecodeError as e:
+                        error = f"JSON parse error: {e}"
+                    except asyncio.TimeoutError:
+                        error = f"Timeout after {LLM_TIMEOUT_SECONDS}s"
+                    except (asyncio.CancelledError, GeneratorExit):
+                        # The client disconnected; closing the generator already aborted the Gemini
+                        # stream. Record the job without waiting, since the generator is being torn
+                        # down, so it doesn't stay "processing" until its TTL expires. Only while it
+                        # is still processing: a "completed" write already in flight wins.
+                        submit_job_store(update_job_status, job_id, "failed", error="Client disconnected", only_if="processing")
+                        raise
+                    except Exception as e:
+                        logger.error(f"Gemini stream error: {e}")
+                        error = f"AI error: {str(e)}"
+                    if error:
+                        await run_job_store(update_job_status, job_id, "failed", error=error)
+                    yield _job_event(await run_job_store(get_job, job_id) or {"status": "failed", "error": error})
+
+                return StreamingResponse(
+                    _events(),
+                    media_type="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                )
+
+            # Static bodies for /health and /, serialized once instead of per request
+            HEALTH_BODY = _dumps({"status": "ok", "service": "spectra-api", "version": "0.2.0"})
+            ROOT_BODY = _dumps({
+                "service": "Spectra API",
+                "version": "0.2.0",
+                "status": "online",
+                "endpoints": {
+                    "POST /": "Generate DevOps files or create async job",
+                    "POST /jobs": "Create a new job",
+                    "GET /job/{job_id}": "Get job status and result",
+                    "GET /job/{job_id}/stream": "Wait for job completion (Server-Sent Events)",
+                    "POST /process/{job_id}": "Trigger job processing",
+                    "POST /process/{job_id}/stream": "Process a job, streaming output (Server-Sent Events)",
+                    "GET /health": "Health check"
+                }
+            })
+
             @app.get("/health")
-            def health():
-                return {"status": "ok", "service": "spectra-api", "version": "0.2.0"}
+            async def health():
+                return Response(content=HEALTH_BODY, media_type="application/json")
 
             @app.get("/")
-            def root():
+            async def root():
                 """API information endpoint."""
-                return {
-                    "service": "Spectra API",
-                    "version": "0.2.0",
-                    "status": "online",
-                    "endpoints": {
-                        "POST /": "Generate DevOps files or create async job",
-                        "POST /jobs": "Create a new job",
-                        "GET /job/{job_id}": "Get job status and result",
-                        "POST /process/{job_id}": "Trigger job processing",
-                        "GET /health": "Health check"
-                    }
-                }
-
-            try:
-                from mangum import Mangum
-                mangum_handler = Mangum(app, lifespan="off")
-                _mangum_available = True
-            except Exception:
-                _mangum_available = False
+                return Response(content=ROOT_BODY, media_type="application/json")
 
         except Exception as e:
             logger.error(f"FastAPI app creation failed: {e}")
             logger.error(traceback.format_exc())
-    app = None
+            app = None
 
     # Fallback app creation
+    def _build_minimal_app():
+        """Health-only FastAPI app, for when the full app can't be built."""
+        mode = "fallback" if FALLBACK_MODE else "minimal"
+        minimal_app = FastAPI(title="Spectra API", version="0.2.0")
+        @minimal_app.get("/health")
+        def h(): return {"status": "ok", "mode": mode}
+        @minimal_app.get("/")
+        def r():
+            return {"service": "Spectra API", "version": "0.2.0", "status": mode}
+        return minimal_app
+
     if app is None:
         try:
-            if not FALLBACK_MODE and FastAPI:
-                app = FastAPI(title="Spectra API", version="0.2.0")
-                @app.get("/health")
-                def h(): return {"status": "ok", "mode": "minimal"}
-                @app.get("/")
-                def r():
-                    return {"service": "Spectra API", "version": "0.2.0", "status": "minimal"}
-            elif FALLBACK_MODE:
-                try:
-                    from fastapi import FastAPI
-                    app = FastAPI(title="Spectra API", version="0.2.0")
-                    @app.get("/health")
-                    def h(): return {"status": "ok", "mode": "fallback"}
-                except Exception:
-                    app = _create_minimal_asgi_app()
-            else:
-                app = _create_minimal_asgi_app()
+            # FastAPI is None only if its import failed above; retrying it wouldn't help
+            app = _build_minimal_app() if FastAPI else _create_minimal_asgi_app()
         except Exception as e:
             logger.error(f"Fallback app creation failed: {e}")
             app = _create_minimal_asgi_app()
 
+    # Constant error bodies for handler(), serialized once
+    HANDLER_UNAVAILABLE_BODY = _dumps({"error": "Unavailable"}).decode()
+    HANDLER_ERROR_BODY = _dumps({"error": "Error"}).decode()
+
     def handler(event=None, context=None):
         try:
-            if not FALLBACK_MODE and _mangum_available and mangum_handler:
+            mangum = get_mangum_handler() if not FALLBACK_MODE and app is not None else None
+            if mangum:
                 try:
-                    r = mangum_handler(event, context)
+                    r = mangum(event, context)
                     if isinstance(r, dict) and "statusCode" in r:
                         return r
-                    return {"statusCode": 200, "headers": {"content-type": "application/json"}, "body": json.dumps(r) if not isinstance(r, str) else r}
+                    return {"statusCode": 200, "headers": {"content-type": "application/json"}, "body": _dumps(r).decode() if not isinstance(r, str) else r}
                 except Exception:
                     pass
-            return {"statusCode": 503, "headers": {"content-type": "application/json"}, "body": json.dumps({"error": "Unavailable"})}
+            return {"statusCode": 503, "headers": {"content-type": "application/json"}, "body": HANDLER_UNAVAILABLE_BODY}
         except Exception:
-            return {"statusCode": 500, "headers": {"content-type": "application/json"}, "body": json.dumps({"error": "Error"})}
+            return {"statusCode": 500, "headers": {"content-type": "application/json"}, "body": HANDLER_ERROR_BODY}
 
 except BaseException as e:
     print(f"FATAL MODULE ERROR: {type(e).__name__}: {e}", file=sys.stderr, flush=True)
@@ -424,7 +1185,7 @@ except BaseException as e:
     app = _create_minimal_asgi_app()
     
     def handler(event=None, context=None):
-        return {"statusCode": 500, "headers": {"content-type": "application/json"}, "body": json.dumps({"error": "Fatal error"})}
+        return {"statusCode": 500, "headers": {"content-type": "application/json"}, "body": _dumps({"error": "Fatal error"}).decode()}
 
 # Final safety check - app MUST exist
 if app is None:
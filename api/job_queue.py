@@ -4,12 +4,16 @@ This module handles job creation, status tracking, and result storage
 for async LLM processing.
 """
 
+import asyncio
 import json
 import uuid
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 import os
 import logging
 import threading
+import time
+
+from serialization import dumps as _dumps, loads as _loads
 
 logger = logging.getLogger(__name__)
 
@@ -17,39 +21,104 @@ logger = logging.getLogger(__name__)
 redis_client = None
 USE_REDIS = False
 
+# When to try connecting again; None once settled (connected, or Redis not configured)
+_redis_retry_at: Optional[float] = 0.0
+_redis_init_lock = threading.Lock()
+# A configured Redis that fails to connect is retried at most this often, not on every call
+REDIS_RETRY_SECONDS = 30.0
+
 # In-memory fallback storage (for local dev only)
 _memory_store: Dict[str, Dict[str, Any]] = {}
 _memory_lock = threading.Lock()
+
+# Statuses after which a job never changes again
+TERMINAL_STATUSES = ("completed", "failed")
+
+# Async Redis client for pub/sub completion notifications - created lazily
+async_redis_client = None
+
+# In-process completion events, used when Redis is not available, and how many
+# wait_for_job calls are waiting on each, so the last one to give up removes it
+_job_events: Dict[str, asyncio.Event] = {}
+_job_waiters: Dict[str, int] = {}
+
+
+def _job_channel(job_id: str) -> str:
+    """Pub/sub channel on which a job's completion is announced."""
+    return f"job:{job_id}:done"
+
+
+def _redis_url() -> Optional[str]:
+    """Redis URL: UPSTASH_REDIS_URL, else REDIS_URL for any other Redis (e.g. Render Key Value)."""
+    return os.getenv("UPSTASH_REDIS_URL") or os.getenv("REDIS_URL")
+
+
+def redis_configured() -> bool:
+    """Whether a Redis URL is set, without connecting."""
+    return bool(_redis_url())
+
+
+def get_redis():
+    """
+    Return the connected Redis client, connecting on first use.
+    
+    Returns:
+        Sync Redis client, or None when jobs are stored in memory
+    """
+    _initialize_redis()
+    return redis_client if USE_REDIS else None
+
+
+def _redis_connection_options() -> Optional[Dict[str, Any]]:
+    """
+    Connection options for the Redis URL, shared by the sync and async clients.
+
+    Returns:
+        Keyword arguments for redis.from_url, or None if credentials are missing
+    """
+    # Fail fast instead of hanging requests when Redis is unreachable
+    options = {"decode_responses": True, "socket_connect_timeout": 5}
+    upstash_url = os.getenv("UPSTASH_REDIS_URL")
+    if not upstash_url:
+        # Plain REDIS_URL: credentials and TLS (rediss://) come from the URL itself
+        return options
+    # Full redis:// URL provided (includes password)
+    if upstash_url.startswith("redis://"):
+        return {**options, "ssl": True}
+    # Separate URL and token provided
+    token = os.getenv("UPSTASH_REDIS_TOKEN")
+    if token:
+        return {**options, "password": token, "ssl": True}
+    return None
+
+
 def _initialize_redis():
-    """Initialize Redis connection lazily (only called when needed)."""
-    global redis_client, USE_REDIS
+    """Initialize the Redis connection once; called on startup and before each job-store use."""
+    global _redis_retry_at
     
-    # If already initialized, skip
-    if redis_client is not None:
+    # Settled, or a failed connection is not due for a retry yet
+    if _redis_retry_at is None or time.monotonic() < _redis_retry_at:
         return
     
+    with _redis_init_lock:
+        if _redis_retry_at is None or time.monotonic() < _redis_retry_at:
+            return
+        _redis_retry_at = None
+        _connect_redis()
+
+
+def _connect_redis():
+    """Create and ping the Redis client, falling back to in-memory storage on failure."""
+    global redis_client, USE_REDIS, _redis_retry_at
+    
     try:
         import redis
-        REDIS_URL = os.getenv("UPSTASH_REDIS_URL")
-        REDIS_TOKEN = os.getenv("UPSTASH_REDIS_TOKEN")
+        REDIS_URL = _redis_url()
         
         if REDIS_URL:
-            # Check if URL is a full redis:// URL or just host
-            if REDIS_URL.startswith("redis://"):
-                # Full redis:// URL provided (includes password)
-                redis_client = redis.from_url(
-                    REDIS_URL,
-                    ssl=True,
-                    decode_responses=True
-                )
-            elif REDIS_TOKEN:
-                # Separate URL and token provided
-                redis_client = redis.from_url(
-                    REDIS_URL,
-                    password=REDIS_TOKEN,
-                    ssl=True,
-                    decode_responses=True
-                )
+            options = _redis_connection_options()
+            if options:
+                redis_client = redis.from_url(REDIS_URL, **options)
             else:
                 logger.warning("UPSTASH_REDIS_TOKEN required when UPSTASH_REDIS_URL doesn't include credentials")
                 redis_client = None
@@ -60,16 +129,17 @@ def _initialize_redis():
             try:
                 redis_client.ping()
                 USE_REDIS = True
-                logger.info("Using Upstash Redis for job queue")
+                logger.info("Using Redis for job queue")
             except Exception as e:
                 logger.error(f"Redis connection test failed: {e}. Using in-memory storage")
                 redis_client = None
                 USE_REDIS = False
+                _redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
         else:
             # Fallback to in-memory for local development
             redis_client = None
             USE_REDIS = False
-            logger.warning("UPSTASH_REDIS_URL not set. Using in-memory storage (not suitable for production)")
+            logger.warning("UPSTASH_REDIS_URL / REDIS_URL not set. Using in-memory storage (not suitable for production)")
     except ImportError:
         redis_client = None
         USE_REDIS = False
@@ -78,6 +148,7 @@ def _initialize_redis():
         redis_client = None
         USE_REDIS = False
         logger.error(f"Failed to connect to Redis: {e}. Using in-memory storage (not suitable for production)")
+        _redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
 
 
 def create_job(context: Dict[str, Any]) -> str:
@@ -101,9 +172,9 @@ def create_job(context: Dict[str, Any]) -> str:
             pipe = redis_client.pipeline()
             pipe.hset(f"job:{job_id}", mapping={
                 "status": "pending",
-                "context": json.dumps(context),
-                "result": json.dumps(None),
-                "error": json.dumps(None)
+                "context": _dumps(context),
+                "result": _dumps(None),
+                "error": _dumps(None)
             })
             pipe.expire(f"job:{job_id}", 3600)  # 1 hour TTL
             pipe.execute()
@@ -149,16 +220,16 @@ def get_job(job_id: str) -> Optional[Dict[str, Any]]:
                 # Convert hash fields back to proper types
                 result = {
                     "status": data.get("status", "pending"),
-                    "context": json.loads(data.get("context", "{}")),
+                    "context": _loads(data.get("context", "{}")),
                 }
                 # Parse result field if it exists
                 if "result" in data and data["result"]:
-                    result["result"] = json.loads(data["result"])
+                    result["result"] = _loads(data["result"])
                 else:
                     result["result"] = None
                 # Parse error field if it exists
                 if "error" in data and data["error"]:
-                    result["error"] = json.loads(data["error"])
+                    result["error"] = _loads(data["error"])
                 else:
                     result["error"] = None
                 return result
@@ -176,7 +247,98 @@ def get_job(job_id: str) -> Optional[Dict[str, Any]]:
             return _memory_store.get(f"job:{job_id}")
 
 
-def update_job_status(job_id: str, status: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+def get_job_state(job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Get a job's status, result and error, without reading or decoding its context.
+    
+    Args:
+        job_id: Job ID
+        
+    Returns:
+        Dict with status, result and error, or None if not found
+    """
+    # Initialize Redis lazily on first use
+    _initialize_redis()
+    
+    if USE_REDIS and redis_client:
+        try:
+            status, result, error = redis_client.hmget(f"job:{job_id}", "status", "result", "error")
+            if status is None:
+                return None
+            return {
+                "status": status,
+                "result": _loads(result) if result else None,
+                "error": _loads(error) if error else None,
+            }
+        except Exception as e:
+            logger.error(f"Failed to get job state from Redis: {e}, trying memory")
+    
+    with _memory_lock:
+        job_data = _memory_store.get(f"job:{job_id}")
+    if not job_data:
+        return None
+    return {"status": job_data.get("status", "pending"), "result": job_data.get("result"), "error": job_data.get("error")}
+
+
+# Pending -> processing as one step on the Redis server, so two instances reading the
+# same pending job can't both claim it. Returns the status and context before the claim.
+_CLAIM_SCRIPT = """
+local job = redis.call('HMGET', KEYS[1], 'status', 'context')
+if job[1] == 'pending' then
+    redis.call('HSET', KEYS[1], 'status', 'processing')
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return job
+"""
+
+
+def claim_job(job_id: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    """
+    Atomically move a pending job to processing.
+
+    Args:
+        job_id: Job ID
+
+    Returns:
+        (claimed, job data with status and context as found), or (False, None) if not found
+    """
+    # Initialize Redis lazily on first use
+    _initialize_redis()
+
+    if USE_REDIS and redis_client:
+        try:
+            status, context = redis_client.eval(_CLAIM_SCRIPT, 1, f"job:{job_id}", 3600)
+            if status is None:
+                return False, None
+            if status == "pending":
+                logger.info(f"Updated job {job_id} to status: processing")
+            return status == "pending", {"status": status, "context": _loads(context) if context else {}}
+        except Exception as e:
+            logger.error(f"Failed to claim job in Redis: {e}, trying memory")
+
+    with _memory_lock:
+        job_data = _memory_store.get(f"job:{job_id}")
+        if not job_data:
+            return False, None
+        found = dict(job_data)
+        if found.get("status") == "pending":
+            job_data["status"] = "processing"
+    return found.get("status") == "pending", found
+
+
+# Same update, applied only while the job still has the expected status (ARGV[1])
+_SET_IF_STATUS_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'status') ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+def update_job_status(job_id: str, status: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None,
+                      only_if: Optional[str] = None):
     """
     Update job status and optionally store result or error.
     Uses atomic Redis pipeline to update individual fields without race conditions.
@@ -186,33 +348,41 @@ def update_job_status(job_id: str, status: str, result: Optional[Dict[str, Any]]
         status: New status ("pending", "processing", "completed", "failed")
         result: Optional result data
         error: Optional error message
+        only_if: Only update while the job has this status; a no-op otherwise
     """
     # Initialize Redis lazily on first use
     _initialize_redis()
     
     if USE_REDIS and redis_client:
         try:
-            # Use pipeline for atomic field updates and TTL refresh
-            pipe = redis_client.pipeline()
-            
-            # Update status field atomically
-            pipe.hset(f"job:{job_id}", "status", status)
-            
-            # Update result field if provided
+            # Status plus any result/error in one HSET; the pipeline keeps it atomic with the TTL refresh
+            fields = {"status": status}
             if result is not None:
-                pipe.hset(f"job:{job_id}", "result", json.dumps(result))
-            
-            # Update error field if provided
+                fields["result"] = _dumps(result)
             if error is not None:
-                pipe.hset(f"job:{job_id}", "error", json.dumps(error))
-            
-            # Refresh TTL to 1 hour
-            pipe.expire(f"job:{job_id}", 3600)
-            
-            # Execute all operations atomically
-            pipe.execute()
+                fields["error"] = _dumps(error)
+            if only_if is not None:
+                args = [only_if, 3600]
+                for name, value in fields.items():
+                    args += (name, value)
+                if not redis_client.eval(_SET_IF_STATUS_SCRIPT, 1, f"job:{job_id}", *args):
+                    return
+            else:
+                pipe = redis_client.pipeline()
+                pipe.hset(f"job:{job_id}", mapping=fields)
+                
+                # Refresh TTL to 1 hour
+                pipe.expire(f"job:{job_id}", 3600)
+                
+                # Execute all operations atomically
+                pipe.execute()
             
             logger.info(f"Updated job {job_id} to status: {status}")
+            if status in TERMINAL_STATUSES:
+                try:
+                    redis_client.publish(_job_channel(job_id), status)
+                except Exception as e:
+                    logger.error(f"Failed to publish completion of job {job_id}: {e}")
         except Exception as e:
             logger.error(f"Failed to update job in Redis: {e}, falling back to memory")
             # Fallback to memory store with atomic read-modify-write
@@ -221,6 +391,8 @@ def update_job_status(job_id: str, status: str, result: Optional[Dict[str, Any]]
                 if not job_data:
                     logger.error(f"Job {job_id} not found in memory fallback")
                     return
+                if only_if is not None and job_data.get("status") != only_if:
+                    return
                 job_data["status"] = status
                 if result is not None:
                     job_data["result"] = result
@@ -235,6 +407,8 @@ def update_job_status(job_id: str, status: str, result: Optional[Dict[str, Any]]
             if not job_data:
                 logger.error(f"Job {job_id} not found")
                 return
+            if only_if is not None and job_data.get("status") != only_if:
+                return
             job_data["status"] = status
             if result is not None:
                 job_data["result"] = result
@@ -242,4 +416,85 @@ def update_job_status(job_id: str, status: str, result: Optional[Dict[str, Any]]
                 job_data["error"] = error
             _memory_store[f"job:{job_id}"] = job_data
         logger.info(f"Updated job {job_id} to status: {status}")
+    
+    if status in TERMINAL_STATUSES:
+        event = _job_events.pop(job_id, None)
+        if event:
+            event.set()
+
+
+async def _get_async_redis():
+    """Return the async Redis client used for pub/sub, creating it on first use."""
+    global async_redis_client
+    if async_redis_client is None:
+        from redis import asyncio as aioredis
+        async_redis_client = aioredis.from_url(_redis_url(), **_redis_connection_options())
+    return async_redis_client
 
+
+async def wait_for_job(job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+    """
+    Wait until a job reaches a terminal status, or until the timeout expires.
+    
+    Uses Redis pub/sub when Redis is configured, so completion is seen across
+    instances; otherwise waits on an in-process event. Redis reads run in a
+    thread, so they don't block the event loop.
+    
+    Args:
+        job_id: Job ID
+        timeout: Maximum seconds to wait
+        
+    Returns:
+        Latest status, result and error, or None if the job does not exist
+    """
+    _initialize_redis()
+    if USE_REDIS and redis_client:
+        job_data = await asyncio.to_thread(get_job_state, job_id)
+        if not job_data or job_data.get("status") in TERMINAL_STATUSES:
+            return job_data
+        pubsub = None
+        try:
+            pubsub = (await _get_async_redis()).pubsub()
+            await pubsub.subscribe(_job_channel(job_id))
+            # Re-check after subscribing so a completion in between isn't missed
+            job_data = await asyncio.to_thread(get_job_state, job_id)
+            if job_data and job_data.get("status") not in TERMINAL_STATUSES:
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + timeout
+                while loop.time() < deadline:
+                    message = await pubsub.get_message(
+                        ignore_subscribe_messages=True,
+                        timeout=deadline - loop.time()
+                    )
+                    if message:
+                        break
+        except Exception as e:
+            logger.error(f"Failed to wait for job {job_id} via Redis: {e}")
+        finally:
+            if pubsub is not None:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+        return await asyncio.to_thread(get_job_state, job_id)
+    
+    job_data = get_job_state(job_id)
+    if not job_data or job_data.get("status") in TERMINAL_STATUSES:
+        return job_data
+    event = _job_events.setdefault(job_id, asyncio.Event())
+    _job_waiters[job_id] = _job_waiters.get(job_id, 0) + 1
+    try:
+        # Re-check after registering so a completion in between isn't missed
+        job_data = get_job_state(job_id)
+        if job_data and job_data.get("status") not in TERMINAL_STATUSES:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        _job_waiters[job_id] -= 1
+        if not _job_waiters[job_id]:
+            del _job_waiters[job_id]
+            # Completion pops the event itself; this clears it for waiters that timed out
+            if _job_events.get(job_id) is event:
+                del _job_events[job_id]
+    return get_job_state(job_id)
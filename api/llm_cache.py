@@ -0,0 +1,151 @@
+"""Response cache for LLM-generated DevOps files.
+
+Generation runs at a low temperature, so the same project context produces
+effectively the same files. Caching the result lets repeat requests skip the
+Gemini round trip entirely.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+import job_queue
+from serialization import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = int(os.getenv("SPECTRA_CACHE_TTL", "86400"))  # 24 hours
+REDIS_THREADS = 4
+
+
+@functools.lru_cache(maxsize=8)
+def _prompt_digest(prompt: str) -> str:
+    # The prompt template is one long constant string, so hash it once, not per request
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+
+def _normalize(content: str) -> str:
+    # Line endings and leading/trailing blank space don't change the generated files,
+    # so a CRLF checkout or an extra trailing newline still hits the same entry
+    return content.replace("\r\n", "\n").strip()
+
+
+class LLMCache:
+    """Two-tier cache: an in-process LRU in front of the job queue's Redis."""
+
+    def __init__(self, max_entries: int = 256, prefix: str = "llm:"):
+        self.max_entries = max_entries
+        self.prefix = prefix
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Own bounded pool for Redis round trips, so a slow Redis can't tie up the
+        # loop's default executor that other blocking work shares
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+    @staticmethod
+    def cache_key(stack: str, files: Dict[str, str], prompt: str = "", model: str = "") -> str:
+        """
+        Build a cache key from the stack, the file contents, the prompt and the model.
+
+        The stack's case and insignificant whitespace in the files are ignored.
+
+        Args:
+            stack: Detected stack name
+            files: Mapping of file paths to contents
+            prompt: Prompt template, so prompt changes invalidate old entries
+            model: Model name, so switching models invalidates old entries
+
+        Returns:
+            Hex SHA-256 digest
+        """
+        payload = {
+            "stack": stack.lower(),
+            "files": {k: hashlib.sha256(_normalize(v).encode()).hexdigest() for k, v in files.items()},
+            "prompt": _prompt_digest(prompt),
+            "model": model,
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached result, checking memory first and then Redis.
+
+        Args:
+            key: Key from cache_key()
+
+        Returns:
+            Cached DevOpsFiles dict or None on miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+
+        # No Redis configured: skip the worker-thread hop for the second tier
+        value = await self._in_thread(self._redis_get, key) if job_queue.redis_configured() else None
+        if value is not None:
+            self._remember(key, value, DEFAULT_TTL)
+        return value
+
+    async def set(self, key: str, value: Dict[str, Any], ttl: int = DEFAULT_TTL):
+        """
+        Store a result in both tiers. Failures are logged, never raised.
+
+        Args:
+            key: Key from cache_key()
+            value: DevOpsFiles dict
+            ttl: Time to live in seconds
+        """
+        self._remember(key, value, ttl)
+        if job_queue.redis_configured():
+            await self._in_thread(self._redis_set, key, value, ttl)
+
+    def close(self):
+        """Shut down the Redis thread pool; it is re-created if the cache is used again."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def _in_thread(self, fn, *args):
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=REDIS_THREADS, thread_name_prefix="llm-cache")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _remember(self, key: str, value: Dict[str, Any], ttl: int):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _redis_get(self, key: str) -> Optional[Dict[str, Any]]:
+        client = job_queue.get_redis()
+        if not client:
+            return None
+        try:
+            data = client.get(f"{self.prefix}{key}")
+            return loads(data) if data else None
+        except Exception as e:
+            logger.error(f"Failed to read LLM cache from Redis: {e}")
+            return None
+
+    def _redis_set(self, key: str, value: Dict[str, Any], ttl: int):
+        client = job_queue.get_redis()
+        if not client:
+            return
+        try:
+            client.set(f"{self.prefix}{key}", dumps(value), ex=ttl)
+        except Exception as e:
+            logger.error(f"Failed to write LLM cache to Redis: {e}")
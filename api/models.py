@@ -1,13 +1,24 @@
 """Pydantic models for Spectra API."""
 
-from pydantic import BaseModel
-from typing import Optional, Dict
+from pydantic import BaseModel, Field, StringConstraints
+from typing import Annotated, Optional, Dict
+
+# Request size limits, enforced while parsing so oversized uploads are rejected
+# before any prompt building, hashing or Redis writes. The CLI sends at most a
+# couple of dozen files of up to 10KB each, far below these.
+MAX_FILES = 200
+MAX_FILENAME_CHARS = 512
+MAX_FILE_CHARS = 100_000
+MAX_CONTEXT_CHARS = 1_000_000  # total across all files, checked by the endpoints (413)
 
 
 class ProjectContext(BaseModel):
     """Project context model."""
-    stack: str
-    files: Dict[str, str]
+    stack: Annotated[str, StringConstraints(max_length=64)]
+    files: Dict[
+        Annotated[str, StringConstraints(max_length=MAX_FILENAME_CHARS)],
+        Annotated[str, StringConstraints(max_length=MAX_FILE_CHARS)],
+    ] = Field(max_length=MAX_FILES)
 
 
 class DevOpsFiles(BaseModel):
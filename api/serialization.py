@@ -0,0 +1,17 @@
+"""JSON (de)serialization shared by the job store and the response cache."""
+
+import json
+
+# orjson is optional: faster (de)serialization of job contexts, stdlib json otherwise
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+
+def dumps(obj) -> bytes:
+    """Serialize obj to JSON bytes."""
+    return orjson.dumps(obj) if orjson else json.dumps(obj).encode()
+
+
+loads = orjson.loads if orjson else json.loads
@@ -552,6 +552,17 @@ TEMPLATES: Dict[str, DevOpsFiles] = {
     "java_gradle": JAVA_TEMPLATE,
 }
 
+# Other common spellings of the stacks above, so clients that don't use the CLI's
+# stack names still get a template instead of an LLM call
+STACK_ALIASES: Dict[str, str] = {
+    "py": "python",
+    "python3": "python",
+    "node": "nodejs",
+    "node.js": "nodejs",
+    "go": "golang",
+    "java": "java_maven",  # Maven and Gradle share JAVA_TEMPLATE
+}
+
 
 def get_template(stack: str) -> Optional[DevOpsFiles]:
     """
@@ -563,5 +574,6 @@ def get_template(stack: str) -> Optional[DevOpsFiles]:
     Returns:
         DevOpsFiles if template exists, None otherwise
     """
-    return TEMPLATES.get(stack.lower())
+    stack = stack.lower()
+    return TEMPLATES.get(STACK_ALIASES.get(stack, stack))
 
@@ -1,12 +1,27 @@
 """HTTP client to communicate with the Spectra API brain with async job polling."""
 
 import httpx
+import json
 import os
 import asyncio
+import contextlib
+import importlib.util
+import random
+import time
 from typing import Optional, Dict, Any
 from rich.panel import Panel
 from rich import print
 
+from . import __version__
+
+# orjson is optional: faster parsing of the generated files, stdlib json otherwise
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+_loads = orjson.loads if orjson else json.loads
+
 # The 'brain' API URL. Set SPECTRA_API_URL environment variable to configure.
 # Default is the stable production domain to make the CLI work out-of-the-box.
 # For local development, override with: export SPECTRA_API_URL=http://127.0.0.1:8000/
@@ -25,33 +40,93 @@ def get_api_url() -> str:
     return url
 
 
-API_URL = get_api_url()
+# Polling configuration: the first re-poll comes quickly and the wait doubles up
+# to POLL_INTERVAL, so short jobs are seen soon without hammering on long ones
+POLL_INITIAL_DELAY = 0.5  # seconds
+POLL_INTERVAL = 3  # seconds, the longest wait between polls
+POLL_TIMEOUT = 120  # seconds, 2 minutes max
+
+# One client per run: the initial POST, the process trigger and every poll share
+# its kept-alive connection instead of paying a new TCP+TLS handshake each time
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+# Negotiate HTTP/2 when httpx's optional h2 dependency is installed (pip install 'httpx[http2]')
+HTTP2 = importlib.util.find_spec("h2") is not None
+# Sent with every request; httpx adds Accept-Encoding itself and decodes gzip transparently
+HTTP_HEADERS = {"Accept": "application/json", "User-Agent": f"spectra-cli/{__version__}"}
+POST_HEADERS = {"Content-Type": "application/json"}
+
+
+def _new_client() -> httpx.AsyncClient:
+    """An AsyncClient with the CLI's timeouts, protocol and default headers."""
+    return httpx.AsyncClient(timeout=HTTP_TIMEOUT, http2=HTTP2, headers=HTTP_HEADERS)
+
+# The initial POST creates a job, so it is only retried when the request can't have been
+# processed: it couldn't connect, or the API (e.g. a cold Vercel function) turned it away
+# with one of these. Other errors, including 500/502/504, are reported straight away.
+POST_MAX_ATTEMPTS = 4
+RETRY_STATUSES = frozenset((429, 503))
+RETRY_AFTER_MAX = 30.0  # seconds; a longer Retry-After is cut to this
 
-# Polling configuration
-POLL_INTERVAL = 3  # seconds
-MAX_POLL_ATTEMPTS = 40  # 2 minutes max (40 * 3s = 120s)
+
+def _retry_delay(attempt: int, response: Optional[httpx.Response] = None) -> float:
+    """Seconds to wait before a retry: the server's Retry-After if it sent one, else jittered backoff."""
+    delay = min(POLL_INTERVAL, POLL_INITIAL_DELAY * 2 ** attempt)
+    delay = delay / 2 + random.uniform(0, delay / 2)
+    if response is not None and response.status_code in (429, 503):
+        try:
+            delay = min(float(response.headers["Retry-After"]), RETRY_AFTER_MAX)
+        except (KeyError, ValueError):
+            pass
+    return delay
+
+
+async def _wait_to_poll(attempt: int, deadline: float, response: Optional[httpx.Response] = None):
+    """Sleep before the next poll, without overshooting the polling deadline."""
+    await asyncio.sleep(max(0.0, min(_retry_delay(attempt, response), deadline - time.monotonic())))
+
+
+async def _post_with_retry(client: httpx.AsyncClient, url: str, **kwargs) -> httpx.Response:
+    """POST, retrying connection failures and RETRY_STATUSES with backoff; returns the last response."""
+    for attempt in range(POST_MAX_ATTEMPTS):
+        last = attempt == POST_MAX_ATTEMPTS - 1
+        try:
+            response = await client.post(url, **kwargs)
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            # Nothing reached the server, so trying again can't duplicate the request
+            if last:
+                raise
+            await asyncio.sleep(_retry_delay(attempt))
+            continue
+        if last or response.status_code not in RETRY_STATUSES:
+            return response
+        print(f":hourglass: [yellow]API returned {response.status_code}, retrying...[/yellow]")
+        await asyncio.sleep(_retry_delay(attempt, response))
 
 
-async def poll_job_status(job_id: str, api_url: str) -> Optional[Dict[str, Any]]:
+async def poll_job_status(job_id: str, api_url: str, client: Optional[httpx.AsyncClient] = None) -> Optional[Dict[str, Any]]:
     """
     Poll the job status endpoint until completion or failure.
     
     Args:
         job_id: Job ID to poll
         api_url: Base API URL
+        client: Open client to poll with; a new one is created if not given
         
     Returns:
         DevOpsFiles dict if completed, None on failure
     """
     attempts = 0
+    deadline = time.monotonic() + POLL_TIMEOUT
     
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        while attempts < MAX_POLL_ATTEMPTS:
+    async with contextlib.AsyncExitStack() as stack:
+        if client is None:
+            client = await stack.enter_async_context(_new_client())
+        while time.monotonic() < deadline:
             try:
                 response = await client.get(f"{api_url}job/{job_id}")
                 response.raise_for_status()
                 
-                job_status = response.json()
+                job_status = _loads(response.content)
                 status = job_status.get("status")
                 
                 if status == "completed":
@@ -77,8 +152,8 @@ async def poll_job_status(job_id: str, api_url: str) -> Optional[Dict[str, Any]]
                     
                 elif status == "pending" or status == "processing":
                     # Continue polling
+                    await _wait_to_poll(attempts, deadline)
                     attempts += 1
-                    await asyncio.sleep(POLL_INTERVAL)
                     continue
                 else:
                     print(Panel(
@@ -99,23 +174,19 @@ async def poll_job_status(job_id: str, api_url: str) -> Optional[Dict[str, Any]]
                     ))
                     return None
                 else:
-                    # Transient error - retry on next poll
+                    # Transient error - retry on next poll, after Retry-After if given
+                    await _wait_to_poll(attempts, deadline, e.response)
                     attempts += 1
-                    if attempts >= MAX_POLL_ATTEMPTS:
-                        break
-                    await asyncio.sleep(POLL_INTERVAL)
                     continue
             except Exception as e:
                 # Generic error - retry on next poll
+                await _wait_to_poll(attempts, deadline)
                 attempts += 1
-                if attempts >= MAX_POLL_ATTEMPTS:
-                    break
-                await asyncio.sleep(POLL_INTERVAL)
                 continue
         
         # Timeout
         print(Panel(
-            f"[bold red]Job polling timeout:[/bold red] Job {job_id} did not complete within {MAX_POLL_ATTEMPTS * POLL_INTERVAL} seconds.",
+            f"[bold red]Job polling timeout:[/bold red] Job {job_id} did not complete within {POLL_TIMEOUT} seconds.",
             title="Timeout",
             border_style="red"
         ))
@@ -141,16 +212,17 @@ async def get_deployment_files(project_context: str) -> Optional[Dict[str, Any]]
     api_url = get_api_url()  # Get fresh URL in case env changed
     
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
+        async with _new_client() as client:
             # Step 1: Send request to main endpoint
-            response = await client.post(
+            response = await _post_with_retry(
+                client,
                 api_url,
                 content=project_context,
-                headers={"Content-Type": "application/json"}
+                headers=POST_HEADERS
             )
             
             response.raise_for_status()
-            result = response.json()
+            result = _loads(response.content)
             
             # Step 2: Check if we got files directly (template cache hit)
             if "dockerfile" in result or "compose" in result or "github_action" in result:
@@ -165,7 +237,7 @@ async def get_deployment_files(project_context: str) -> Optional[Dict[str, Any]]
                 # Trigger job processing
                 try:
                     process_response = await client.post(f"{api_url}process/{job_id}")
-                    if process_response.status_code == 200:
+                    if process_response.status_code in (200, 202):
                         print(":gear: [cyan]Job processing started...[/cyan]")
                     else:
                         print(f":warning: [yellow]Could not trigger processing automatically. Status: {process_response.status_code}[/yellow]")
@@ -173,8 +245,8 @@ async def get_deployment_files(project_context: str) -> Optional[Dict[str, Any]]
                     print(f":warning: [yellow]Could not trigger processing automatically: {e}[/yellow]")
                     # Continue anyway - job might be processed by background worker
                 
-                # Poll for job completion
-                return await poll_job_status(job_id, api_url)
+                # Poll for job completion over the same connection
+                return await poll_job_status(job_id, api_url, client)
             
             # Unexpected response format
             print(Panel(
@@ -187,9 +259,10 @@ async def get_deployment_files(project_context: str) -> Optional[Dict[str, Any]]
     except httpx.HTTPStatusError as e:
         error_msg = f"{e.response.status_code}"
         try:
-            error_detail = e.response.json()
+            error_detail = _loads(e.response.content)
             error_msg += f" - {error_detail.get('detail', e.response.text)}"
-        except:
+        except (ValueError, AttributeError):
+            # Not JSON (both parsers raise ValueError subclasses), or JSON without a detail
             error_msg += f" - {e.response.text}"
         print(Panel(
             f"[bold red]API Error:[/bold red] {error_msg}",
@@ -206,9 +279,9 @@ async def get_deployment_files(project_context: str) -> Optional[Dict[str, Any]]
         ))
         return None
     except httpx.RequestError as e:
-        url = getattr(e.request, 'url', api_url) if hasattr(e, 'request') else api_url
+        # httpx always attaches the request to errors raised while sending one
         print(Panel(
-            f"[bold red]Network Error:[/bold red] Failed to connect to {url}. "
+            f"[bold red]Network Error:[/bold red] Failed to connect to {e.request.url} ({e!r}). "
             f"Is the API running? Check SPECTRA_API_URL environment variable.",
             title="Connection Error",
             border_style="red"
@@ -102,5 +102,6 @@ def scan_project(path: str) -> Optional[str]:
         return None
 
     print(f":white_check_mark: [bold green]Scan complete.[/bold green] Found stack: [bold]{context['stack']}[/bold]")
-    return json.dumps(context, indent=2)
+    # Compact, and non-ASCII left as UTF-8 rather than \u escapes: this is only sent to the API
+    return json.dumps(context, separators=(",", ":"), ensure_ascii=False)
 